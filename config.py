@@ -1,15 +1,28 @@
 import yaml
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+# libyaml's C loader is much faster; fall back to the pure-Python one without it
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+CONFIG_PATH = "analyzer_config.yml"
 
 @dataclass
 class AnalyzerConfig:
-    ignore_paths: List[str]
-    size_threshold_mb: int
-    cache_results: bool
-    parallel_analysis: bool
+    ignore_paths: List[str] = field(default_factory=list)
+    size_threshold_mb: int = 10
+    cache_results: bool = True
+    parallel_analysis: bool = True
+    # When set, only files added on top of this image's layers are analyzed
+    base_image: Optional[str] = None
+    # Seconds to watch the container for file access events; the analyzer's
+    # container runs no workload of its own, so the watch is off by default
+    access_window: float = 0
+    # Report only the first N unused paths in sorted order; None reports all, unsorted
+    unused_files_limit: Optional[int] = None
 
-def load_config(config_path: str = "analyzer_config.yml") -> AnalyzerConfig:
+def load_config(config_path: str = CONFIG_PATH) -> AnalyzerConfig:
     with open(config_path, 'r') as f:
-        config_data = yaml.safe_load(f)
-    return AnalyzerConfig(**config_data) 
\ No newline at end of file
+        config_data = yaml.load(f, Loader=_YamlLoader)
+    # An empty file loads as None
+    return AnalyzerConfig(**(config_data or {})) 
\ No newline at end of file
@@ -5,12 +5,20 @@ class ContainerManager:
     def __init__(self, client):
         self.client = client
         self.active_container = None
+        self._containers = {}  # image name -> container handed out for it
 
     def ensure_container_exists(self, image_name: str) -> Optional[docker.models.containers.Container]:
         """Creates a container if it doesn't exist, or returns existing one"""
         print(f"Ensuring container exists for image: {image_name}")
         
         try:
+            # Reuse the container from an earlier call while it is still up
+            container = self._containers.pop(image_name, None)
+            if container and self._is_running(container):
+                self._containers[image_name] = container
+                self.active_container = container
+                return container
+
             # First, check for existing running containers with this image
             containers = self.client.containers.list(
                 filters={'ancestor': image_name, 'status': 'running'}
@@ -19,6 +27,7 @@ class ContainerManager:
             if containers:
                 print(f"Found existing running container: {containers[0].id[:12]}")
                 self.active_container = containers[0]
+                self._containers[image_name] = containers[0]
                 return containers[0]
             
             # If no running container found, create a new one
@@ -43,6 +52,7 @@ class ContainerManager:
                 return None
             
             print(f"Container created and started: {container.id[:12]}")
+            self._containers[image_name] = container
             return container
             
         except docker.errors.ImageNotFound:
@@ -55,6 +65,13 @@ class ContainerManager:
             print(f"Error testing container: {e}")
             return None
 
+    def _is_running(self, container) -> bool:
+        try:
+            container.reload()
+        except docker.errors.NotFound:
+            return False  # Removed behind our back
+        return container.status == 'running'
+
     def cleanup(self):
         """Cleanup the active container"""
         if self.active_container:
@@ -68,3 +85,4 @@ class ContainerManager:
                 except docker.errors.APIError as e:
                     print(f"Error cleaning up container: {e}")
             self.active_container = None
+        self._containers.clear()
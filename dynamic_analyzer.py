@@ -1,48 +1,110 @@
+import io
+import re
+import tarfile
 import time
-from typing import Set
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Set
+from utils import stream_exec_lines
+
+# Shared trace written inside the container, read back after it stops
+TRACE_PATH = '/tmp/.dynamic_trace'
+
+# Upper bounds for the readiness polls that replace fixed sleeps
+STARTUP_TIMEOUT = 5.0
+POLL_INTERVAL = 0.1
+
+# strace -f lines: "<pid> openat(AT_FDCWD, "/path", ...)" in a -o file, and
+# "[pid <pid>] openat(...)" for children when strace writes to stderr
+_TRACE_LINE_RE = re.compile(
+    rb'^(?:\[pid +\d+\] |\d+ +)?open(?:at)?\([^"\n]*"([^"\n]+)"', re.MULTILINE
+)
+
+def _trace_paths(data: bytes) -> Set[str]:
+    return {match.group(1).decode('utf-8', 'replace') for match in _TRACE_LINE_RE.finditer(data)}
 
 class DynamicAnalyzer:
     def __init__(self, container):
         self.container = container
         self.accessed_files = set()
-        
+
     def analyze(self) -> Set[str]:
         """Perform comprehensive dynamic analysis"""
+        # Restart once; a single tracer then covers the runtime and shutdown phases
+        self.container.stop()
+        self.container.start()
+        self._wait_until(self._is_running)  # Allow startup to complete
+
         # Track startup files
         startup_files = self._track_startup()
-        
+
         # Track runtime files with different scenarios
+        self._start_tracer()
         runtime_files = self._track_runtime_scenarios()
-        
-        # Track shutdown files
-        shutdown_files = self._track_shutdown()
-        
-        return startup_files | runtime_files | shutdown_files
-        
+
+        # Stopping the container ends the trace, which then holds shutdown too
+        self.container.stop()
+        traced_files = self._harvest_trace()
+        self.container.start()
+
+        # Merge in place rather than building a throwaway set per '|'
+        startup_files.update(runtime_files, traced_files)
+        return startup_files
+
+    def _wait_until(self, condition, timeout: float = STARTUP_TIMEOUT) -> bool:
+        """Poll condition until it holds or timeout expires, instead of sleeping blindly"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(POLL_INTERVAL)
+        return False
+
+    def _is_running(self) -> bool:
+        self.container.reload()
+        return self.container.status == 'running' and self.container.exec_run('true').exit_code == 0
+
     def _track_startup(self) -> Set[str]:
         """Track files accessed during container startup"""
         accessed = set()
-        
-        # Stop current container
-        self.container.stop()
-        
-        # Start with tracing enabled
-        self.container.start()
-        time.sleep(5)  # Allow startup to complete
-        
-        # Collect startup files
-        exec_result = self.container.exec_run('cat /proc/*/maps')
-        if exec_result.exit_code == 0:
-            for line in exec_result.output.decode().split('\n'):
-                if line.startswith('/'):
-                    accessed.add(line.split()[5])
-                    
+
+        # Collect startup files; one exec reads every process's maps, parsed as it streams
+        cmd = ['sh', '-c', 'for f in /proc/[0-9]*/maps; do cat "$f" 2>/dev/null; done']
+        for line in stream_exec_lines(self.container, cmd):
+            # address perms offset dev inode pathname; anonymous maps have no path
+            fields = line.split(None, 5)
+            if len(fields) == 6 and fields[5].startswith(b'/'):
+                accessed.add(fields[5].decode('utf-8', 'replace'))
+
         return accessed
-        
+
+    def _start_tracer(self):
+        """Attach one strace to the container's init for the rest of the analysis"""
+        self.container.exec_run(['rm', '-f', TRACE_PATH])  # Left over from an earlier run
+        self.container.exec_run(
+            ['strace', '-f', '-e', 'trace=open,openat', '-p', '1', '-o', TRACE_PATH],
+            privileged=True,
+            detach=True
+        )
+        # strace creates its output file once it is up; wait for that before tracing
+        self._wait_until(lambda: self.container.exec_run(['test', '-f', TRACE_PATH]).exit_code == 0)
+
+    def _harvest_trace(self) -> Set[str]:
+        """Read the paths opened in the shared trace back"""
+        try:
+            bits, _ = self.container.get_archive(TRACE_PATH)
+            with tarfile.open(fileobj=io.BytesIO(b''.join(bits))) as archive:
+                member = archive.next()
+                data = archive.extractfile(member).read() if member else b''
+        except Exception as e:
+            print(f"Error reading dynamic trace: {e}")
+            return set()
+
+        return _trace_paths(data)
+
     def _track_runtime_scenarios(self) -> Set[str]:
         """Track files during different runtime scenarios"""
         accessed = set()
-        
+
         # Common runtime scenarios
         scenarios = [
             self._exercise_network_activity,
@@ -50,31 +112,36 @@ class DynamicAnalyzer:
             self._exercise_process_creation,
             self._exercise_dynamic_loading
         ]
-        
-        for scenario in scenarios:
-            accessed.update(scenario())
-            
+
+        # Scenarios only wait on exec_run calls, so threads overlap them
+        with ThreadPoolExecutor(max_workers=len(scenarios)) as executor:
+            accessed.update(*executor.map(lambda scenario: scenario(), scenarios))
+
         return accessed
-        
-    def _exercise_dynamic_loading(self) -> Set[str]:
-        """Track dynamically loaded libraries and plugins"""
-        accessed = set()
-        
-        # Monitor library loading
-        exec_result = self.container.exec_run(
-            'strace -f -e trace=open,openat -p 1 2>&1',
-            privileged=True
+
+    def _run_traced(self, cmd: List[str]) -> Set[str]:
+        """Run cmd under its own strace and return the paths it and its children opened"""
+        # Exec sessions are not descendants of PID 1, so the shared tracer never sees them
+        result = self.container.exec_run(
+            ['strace', '-f', '-e', 'trace=open,openat', *cmd],
+            privileged=True,
+            demux=True
         )
-        
-        # Trigger some activity
-        self.container.exec_run('ldconfig')
-        time.sleep(2)
-        
-        # Parse results
-        if exec_result.exit_code == 0:
-            for line in exec_result.output.decode().split('\n'):
-                if 'open(' in line and '.so' in line:
-                    path = line.split('"')[1]
-                    accessed.add(path)
-                    
-        return accessed
+        _, stderr = result.output  # strace reports on stderr
+        return _trace_paths(stderr or b'')
+
+    def _exercise_network_activity(self) -> Set[str]:
+        """Resolve a name, loading the resolver libraries and nsswitch config"""
+        return self._run_traced(['getent', 'hosts', 'localhost'])
+
+    def _exercise_filesystem_operations(self) -> Set[str]:
+        """List and stat the root tree"""
+        return self._run_traced(['ls', '-la', '/'])
+
+    def _exercise_process_creation(self) -> Set[str]:
+        """Fork and exec a child through the shell"""
+        return self._run_traced(['sh', '-c', 'true'])
+
+    def _exercise_dynamic_loading(self) -> Set[str]:
+        """Trigger dynamic library loading"""
+        return self._run_traced(['ldconfig'])
@@ -1,23 +1,76 @@
 import subprocess
 from typing import Set, Dict, Optional
+import logging
+import mmap
 import platform
 import os
+import re
+import shutil
+import threading
 import time
+from utils import stream_exec_lines
+
+log = logging.getLogger(__name__)
+
+# Mounted tracefs means syscall tracepoints are available to eBPF tracers
+TRACEFS_PATH = '/sys/kernel/debug/tracing'
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# In-container watch of the root filesystem; system trees are not worth a watch each
+_INOTIFY_CMD = (
+    "inotifywait -mrq -e open,access --format '%e %w%f' "
+    "--exclude '^/(proc|sys|dev|run|tmp)(/|$)' /"
+)
+
+# Host OS picks the tracer; it cannot change while the process runs
+_OS_TYPE = platform.system()
+
+# Compiled once and run over raw bytes, so parsing needs no per-line Python work
+_STRACE_PATH_RE = re.compile(rb'(?:\bopen(?:at)?\(|^filename:)[^"\n]*"([^"\n]+)"', re.MULTILINE)
+# perf trace prints filename: /path, quoted or not depending on the perf version
+# Arguments are "dfd: X, filename: ..."; negated classes cannot run past a line
+_PERF_PATH_RE = re.compile(rb'\bopenat\(dfd: [^,\n]*, filename: "?([^",)\n]+)')
+# [ \t] rather than \s, which would match the newline and join lines
+_DTRACE_PATH_RE = re.compile(rb'^[ \t]*\w*(?:open|stat)\w*[ \t]+([^\n]*[^\s])', re.MULTILINE)
 
 class FileAccessTracker:
-    def __init__(self, container_id: str):
-        self.container_id = container_id
+    def __init__(self, container):
+        self.container = container
         self.dtrace_process = None
         self.accessed_files = set()
-        self.os_type = platform.system()
+        self.os_type = _OS_TYPE
+        self._consumer = None
+        self._stop_consumer = threading.Event()
         
     def start_tracking(self):
         """Start tracking based on OS type"""
         if self.os_type == 'Darwin':  # macOS
-            return self._start_dtrace()
+            if self._start_dtrace():
+                self._start_consumer('dtrace_output.txt', _DTRACE_PATH_RE)
+                return True
         elif self.os_type == 'Linux':
-            return self._start_strace()
+            # Prefer in-kernel tracers; strace's ptrace stops slow the traced process most
+            if self._tracepoints_available('bpftrace') and self._start_bpftrace():
+                path_re = _STRACE_PATH_RE
+            elif self._tracepoints_available('perf') and self._start_perf_trace():
+                path_re = _PERF_PATH_RE
+            elif self._start_strace():
+                path_re = _STRACE_PATH_RE
+            else:
+                return False
+            self._start_consumer('strace_output.txt', path_re)
+            return True
         return False
+
+    def _tracepoints_available(self, tool: str) -> bool:
+        """Check whether a tracepoint-based tool and the syscall tracepoints can be used"""
+        return shutil.which(tool) is not None and os.path.isdir(TRACEFS_PATH)
+
+    def _container_pid(self) -> str:
+        # Read over the SDK's open socket instead of forking docker inspect; the
+        # raw inspect leaves the container model, shared with other phases, untouched
+        api = self.container.client.api
+        return str(api.inspect_container(self.container.id)['State']['Pid'])
             
     def _start_dtrace(self) -> bool:
         """Start dtrace for macOS"""
@@ -30,79 +83,173 @@ class FileAccessTracker:
         '''
         try:
             # Get container PID
-            cmd = ["docker", "inspect", "-f", '{{.State.Pid}}', self.container_id]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            pid = result.stdout.strip()
+            pid = self._container_pid()
             
             # Write dtrace script
             with open('file_trace.d', 'w') as f:
                 f.write(dtrace_script)
             
-            # Start dtrace
+            # Start dtrace; the trace goes to -o, its own output is discarded. sudo -n
+            # fails rather than prompting for a password behind the progress bar
             self.dtrace_process = subprocess.Popen([
-                'sudo', 'dtrace', '-s', 'file_trace.d',
+                'sudo', '-n', 'dtrace', '-s', 'file_trace.d',
                 '-p', pid, '-o', 'dtrace_output.txt'
-            ])
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             return True
         except Exception as e:
             print(f"Error starting dtrace: {e}")
             return False
             
+    def _start_bpftrace(self) -> bool:
+        """Start bpftrace for Linux (eBPF, far lower overhead than ptrace)"""
+        try:
+            pid = self._container_pid()
+
+            # On cgroup v2 filter on the container's cgroup, which covers every
+            # process in it rather than only the init process
+            cgroup_path = self._cgroup_path(pid)
+            if cgroup_path:
+                predicate = f'/cgroup == cgroupid("{cgroup_path}")/'
+            else:
+                predicate = f'/pid == {pid}/'
+
+            # Lines are emitted as filename:"<path>" so the strace parser can read them
+            bpftrace_script = (
+                f'tracepoint:syscalls:sys_enter_openat {predicate} '
+                '{ printf("filename:\\"%s\\"\\n", str(args->filename)); }'
+            )
+            self.strace_process = subprocess.Popen([
+                'sudo', '-n', 'bpftrace', '-e', bpftrace_script,
+                '-o', 'strace_output.txt'
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            return True
+        except Exception as e:
+            print(f"Error starting bpftrace: {e}")
+            return False
+
+    def _cgroup_path(self, pid: str) -> Optional[str]:
+        """Unified (v2) cgroup directory of a host PID, None on cgroup v1 hosts"""
+        try:
+            with open(f'/proc/{pid}/cgroup') as f:
+                for line in f:
+                    # The root cgroup would match every process on the host
+                    if line.startswith('0::') and line[3:].strip() != '/':
+                        path = CGROUP_ROOT + line[3:].strip()
+                        return path if os.path.isdir(path) else None
+        except OSError:
+            pass
+        return None
+
+    def _start_perf_trace(self) -> bool:
+        """Start perf trace for Linux, tracepoint based like bpftrace"""
+        try:
+            pid = self._container_pid()
+            self.strace_process = subprocess.Popen([
+                'sudo', '-n', 'perf', 'trace', '-e', 'openat',
+                '-p', pid, '-o', 'strace_output.txt'
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            return True
+        except Exception as e:
+            print(f"Error starting perf trace: {e}")
+            return False
+
     def _start_strace(self) -> bool:
         """Start strace for Linux"""
         try:
-            cmd = ["docker", "inspect", "-f", '{{.State.Pid}}', self.container_id]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            pid = result.stdout.strip()
+            pid = self._container_pid()
             
             self.strace_process = subprocess.Popen([
-                'sudo', 'strace', '-f', 
+                'sudo', '-n', 'strace', '-f', 
                 '-e', 'trace=open,openat,stat,access',
                 '-p', pid, '-o', f'strace_output.txt'
-            ])
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             return True
         except Exception as e:
             print(f"Error starting strace: {e}")
             return False
 
-    def get_accessed_files(self) -> Dict[str, Set[str]]:
-        """Collect results based on OS type"""
-        if self.os_type == 'Darwin':
-            return self._parse_dtrace_output()
-        elif self.os_type == 'Linux':
-            return self._parse_strace_output()
-        return {'files': set()}
+    def track_access(self, duration: float = 2.0) -> Set[str]:
+        """Collect files opened inside the container during a bounded window
 
-    def _parse_dtrace_output(self) -> Dict[str, Set[str]]:
-        files = set()
+        inotifywait streams events over the exec socket, so nothing is traced
+        on the host. Without it a host tracer watches the container for the
+        same window; with neither, nothing is reported, since the container's
+        diff holds changed files, not accessed ones.
+        """
         try:
-            with open('dtrace_output.txt', 'r') as f:
-                for line in f:
-                    if 'open' in line or 'stat' in line:
-                        parts = line.strip().split()
-                        if len(parts) >= 2:
-                            files.add(parts[-1])
-        except FileNotFoundError:
-            pass
-        return {'files': files}
+            cmd = ['sh', '-c', f'timeout {duration:g} {_INOTIFY_CMD}']
+            # 124 is timeout ending the window; anything else (missing tools, or
+            # inotifywait running out of max_user_watches) means the watch failed
+            for line in stream_exec_lines(self.container, cmd, ok_exit_codes=(0, 124)):
+                self._add_inotify_event(line)
+        except RuntimeError as e:
+            log.info("No file access watcher available in the container: %s", e)
+            if self.start_tracking():
+                try:
+                    time.sleep(duration)
+                finally:
+                    # Stops the tracer and lets the consumer drain its output
+                    self.cleanup()
+            else:
+                log.info("No host tracer available either, file access is not tracked")
+        except Exception as e:
+            print(f"Error watching file access: {e}")
+        return set(self.accessed_files)
 
-    def _parse_strace_output(self) -> Dict[str, Set[str]]:
-        files = set()
-        try:
-            with open('strace_output.txt', 'r') as f:
-                for line in f:
-                    if 'open(' in line or 'openat(' in line:
-                        if '"' in line:
-                            path = line.split('"')[1]
-                            files.add(path)
-        except FileNotFoundError:
-            pass
-        return {'files': files}
+    def _add_inotify_event(self, line: bytes):
+        events, _, path = line.partition(b' ')
+        if path and b'ISDIR' not in events:
+            self.accessed_files.add(path.decode('utf-8', 'replace'))
+
+    def get_accessed_files(self) -> Dict[str, Set[str]]:
+        """Return the files seen so far by the access window or the consumer thread"""
+        return {'files': set(self.accessed_files)}
+
+    def _start_consumer(self, output_path: str, path_re: re.Pattern):
+        """Follow the tracer output file and parse lines as they are written"""
+        self._stop_consumer.clear()
+        self._consumer = threading.Thread(
+            target=self._consume, args=(output_path, path_re), daemon=True
+        )
+        self._consumer.start()
+
+    def _consume(self, output_path: str, path_re: re.Pattern):
+        # The tracer creates its output file asynchronously
+        while not os.path.exists(output_path):
+            if self._stop_consumer.is_set():
+                return
+            time.sleep(0.05)
+
+        with open(output_path, 'rb') as f:
+            offset = 0
+            while True:
+                size = os.fstat(f.fileno()).st_size
+                if size > offset:
+                    # Map the file instead of copying it; only the new pages are touched
+                    with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                        # Only scan complete lines, a partial write is picked up next time
+                        end = mm.rfind(b'\n', offset, size) + 1
+                        if end > offset:
+                            for match in path_re.finditer(mm, offset, end):
+                                self.accessed_files.add(match.group(1).decode('utf-8', 'replace'))
+                            offset = end
+                            continue
+                if self._stop_consumer.is_set():
+                    break
+                time.sleep(0.05)
+
+    def _stop_consuming(self):
+        """Let the consumer drain what the tracer wrote, then wait for it"""
+        if self._consumer:
+            self._stop_consumer.set()
+            self._consumer.join(timeout=5)
+            self._consumer = None
 
     def cleanup(self):
         """Cleanup tracking resources"""
         if self.dtrace_process:
             self.dtrace_process.terminate()
+            self._stop_consuming()
             try:
                 os.remove('file_trace.d')
                 os.remove('dtrace_output.txt')
@@ -110,6 +257,7 @@ class FileAccessTracker:
                 pass
         if hasattr(self, 'strace_process') and self.strace_process:
             self.strace_process.terminate()
+            self._stop_consuming()
             try:
                 os.remove('strace_output.txt')
             except OSError:
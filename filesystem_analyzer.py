@@ -1,76 +1,341 @@
-from typing import List, Dict, Optional, Set, Tuple
-import os
-from dynamic_analyzer import DynamicAnalyzer
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from functools import lru_cache
+import hashlib
+import io
+import json
+import logging
+import re
+import posixpath
+import shlex
+import tarfile
+from utils import load_cached, store_cached, stream_exec_lines
+
+log = logging.getLogger(__name__)
+
+_SYSTEM_PATHS = frozenset({
+    '/proc', '/sys', '/dev', '/tmp', '/run', '/var/run',
+    '/var/lock', '/var/cache', '/var/log'
+})
+# One anchored alternation, matched in C instead of a Python loop per root
+_SYSTEM_PATH_RE = re.compile(
+    r'^(?:' + '|'.join(re.escape(p) for p in sorted(_SYSTEM_PATHS)) + r')(?:/|$)'
+)
+
+# Still listed by find, though never counted as unused, so package caches can be sized
+_LISTED_SYSTEM_PATHS = frozenset({'/var/cache'})
+
+@lru_cache(maxsize=65536)
+def _is_system_dir(directory: str) -> bool:
+    # Files cluster by directory, so each parent is matched once for all its entries
+    return bool(_SYSTEM_PATH_RE.match(directory))
+
+# Open fd targets and memory-mapped files of every process in the container.
+# readlink and cat are BusyBox applets too, so this works where find has no
+# -printf. sed keeps each line's path (maps' other fields and socket or pipe
+# targets hold no '/'), and sort -u drops the repeats from libraries mapped by
+# many processes, before they are sent. The PIDs are globbed by the shell before
+# it forks anything, and the shell's own ($$) is skipped, so the scan's sh,
+# readlink, cat, sed and sort are not counted as used
+_USED_FILES_SCRIPT = (
+    r'set -- /proc/[0-9]*; '
+    r'for p; do [ "$p" = "/proc/$$" ] && continue; '
+    r'for f in "$p"/fd/*; do readlink "$f"; done; cat "$p/maps"; '
+    r'done 2>/dev/null | sed -n "s|^[^/]*/|/|p" | sort -u'
+)
+_USED_MARKER = b'###USED###'
+
+# Probe find for -printf and install findutils if it is missing, all in one exec.
+# If the image shipped without apt lists, the ones the install fetched are removed
+# again, so they are not reported as the image's package cache
+_PRINTF_FIND_SCRIPT = (
+    "find / -maxdepth 0 -printf '' 2>/dev/null && exit 0; "
+    "if [ -f /etc/alpine-release ]; then apk add --no-cache findutils; "
+    "else lists=$(ls /var/lib/apt/lists 2>/dev/null | grep -v -e '^lock$' -e '^partial$'); "
+    "apt-get update && apt-get install -y findutils; "
+    "[ -n \"$lists\" ] || { apt-get clean; rm -rf /var/lib/apt/lists/*; }; fi >/dev/null 2>&1; "
+    "find / -maxdepth 0 -printf ''"
+)
+
+# Containers already known to have a find that supports -printf
+_PRINTF_FIND_READY: Set[str] = set()
+
+# Members of a saved image up to this size are read whole, to tell JSON from tar
+_MAX_DOCUMENT_SIZE = 1 << 20
+
+def _blob_name(digest: str) -> str:
+    """Tar member of an OCI blob, from its 'sha256:<hex>' digest"""
+    algorithm, _, hexdigest = digest.partition(':')
+    return f"blobs/{algorithm}/{hexdigest}"
+
+class _ChunkReader:
+    """Minimal file object over an iterator of byte chunks, for streaming tarfile"""
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+        self._pos = 0  # Start of the unread data, so reads never copy the remainder
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) - self._pos < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            if self._pos:
+                # Drop consumed bytes only when the buffer has to grow anyway
+                del self._buffer[:self._pos]
+                self._pos = 0
+            self._buffer += chunk
+        end = len(self._buffer) if size < 0 else self._pos + size
+        data = bytes(self._buffer[self._pos:end])
+        self._pos += len(data)
+        return data
 
 class FilesystemAnalyzer:
-    def __init__(self, container):
+    def __init__(self, container, meta=None, cache_results: bool = False,
+                 ignore_paths: Iterable[str] = (), base_image: Optional[str] = None):
         self.container = container
+        self.meta = meta  # Shared ImageMetadata, saves re-inspecting the image
+        self.cache_results = cache_results
+        self.ignore_paths = sorted({p.rstrip('/') for p in ignore_paths if p.rstrip('/')})
+        self.base_image = base_image
+        self._scanned_used = None  # Used files collected by the fused listing exec
+        self._files_with_size = None  # Listing already produced by this analyzer
+
+    def _find_command(self) -> str:
+        """Build the file listing command, pruning ignored and system trees inside find itself"""
+        # System trees are dropped from the analysis anyway, so they never cross the socket
+        pruned = sorted((_SYSTEM_PATHS - _LISTED_SYSTEM_PATHS).union(self.ignore_paths))
+        clauses = ' -o '.join(f"-path {shlex.quote(p)}" for p in pruned)
+        prune = rf"\( {clauses} \) -prune -o "
+        # -xdev keeps find on the root filesystem, out of /proc, /sys and other mounts
+        return rf"find / -xdev {prune}-type f -printf '%s %p\n'"
+
+    def _stream_lines(self, cmd) -> Iterator[bytes]:
+        """Run a command in the container and yield stdout lines as they arrive"""
+        return stream_exec_lines(self.container, cmd)
 
     def get_all_files_with_size(self) -> List[Tuple[str, int]]:
         """Get list of all files in container with their sizes"""
+        # Walk the filesystem at most once per analyzer; a failed (empty) walk is retried
+        if not self._files_with_size:
+            self._files_with_size = self._list_files_with_size()
+        return self._files_with_size
+
+    def _listing_cache_key(self) -> str:
+        # The listing only depends on the image and the prune settings; the used
+        # files scan is live process state and is never stored
+        image_id = self.meta.id if self.meta else self.container.attrs['Image']
+        settings = json.dumps({'ignore_paths': self.ignore_paths, 'base_image': self.base_image})
+        return f"files_{image_id}_{hashlib.sha1(settings.encode()).hexdigest()[:12]}"
+
+    def _list_files_with_size(self) -> List[Tuple[str, int]]:
+        cache_key = self._listing_cache_key() if self.cache_results else None
+        if cache_key:
+            cached = load_cached(cache_key)
+            if cached is not None:
+                return [(path, size) for path, size in cached]
+
+        files_with_size = self._read_files_with_size()
+        if cache_key and files_with_size:
+            store_cached(cache_key, files_with_size)
+        return files_with_size
+
+    def _read_files_with_size(self) -> List[Tuple[str, int]]:
+        if self.base_image:
+            return self.get_layer_files_with_size(self.base_image)
+
         try:
             # First ensure we have the tools we need
-            self.container.exec_run('which find || apt-get update && apt-get install -y findutils')
-            
-            # Use a more reliable command with proper escaping
-            cmd = r"""find / -type f -exec sh -c 'echo $(du -ab "{}" | cut -f1) "{}"' \;"""
-            exec_command = self.container.exec_run(['sh', '-c', cmd])
-            
-            if exec_command.exit_code != 0:
-                print(f"Error running find command: {exec_command.output.decode('utf-8')}")
-                return []
-            
-            files_with_size = []
-            for line in exec_command.output.decode('utf-8').split('\n'):
-                if line:
-                    try:
-                        # Format: size path
-                        parts = line.strip().split(maxsplit=1)
-                        if len(parts) == 2:
-                            size = int(parts[0])
-                            path = parts[1].strip('"')  # Remove quotes
-                            files_with_size.append((path, size))
-                    except (IndexError, ValueError) as e:
-                        continue
+            if self._ensure_printf_find():
+                files_with_size = self._find_files_with_size()
+            else:
+                # No usable find, read the listing from the container's export instead
+                files_with_size = self.get_exported_files_with_size()
             
-            print(f"Debug: Found {len(files_with_size)} total files with sizes")
-            total_size = sum(size for _, size in files_with_size)
-            print(f"Debug: Total size of all files: {total_size} bytes")
+            log.debug("Found %d total files with sizes", len(files_with_size))
+            if log.isEnabledFor(logging.DEBUG):
+                # Summing is a full pass over the listing, only pay for it when shown
+                log.debug("Total size of all files: %d bytes", sum(size for _, size in files_with_size))
             
             return files_with_size
         except Exception as e:
             print(f"Error getting files with sizes: {e}")
             return []
 
-    def get_lsof_files(self) -> Set[str]:
-        """Get list of files currently opened by processes"""
+    def _find_files_with_size(self) -> List[Tuple[str, int]]:
+        # A single find process prints size and path, no fork per file. The
+        # open/mapped file scan rides along in the same exec, after a marker
+        script = f"{self._find_command()}; echo '{_USED_MARKER.decode()}'; {_USED_FILES_SCRIPT}"
+        files_with_size = []
+        used = set()
+        in_used = False
+        for line in self._stream_lines(['sh', '-c', script]):
+            if in_used:
+                if line.startswith(b'/'):
+                    used.add(line.decode('utf-8', 'replace'))
+            elif line == _USED_MARKER:
+                in_used = True
+            elif line:
+                try:
+                    # Format: size path
+                    size, path = line.split(b' ', 1)
+                    files_with_size.append((path.decode('utf-8', 'replace'), int(size)))
+                except ValueError:
+                    continue
+        self._scanned_used = used
+        return files_with_size
+
+    def _ensure_printf_find(self) -> bool:
+        """Install findutils only if find lacks -printf (e.g. BusyBox), checked once per container"""
+        if self.container.id in _PRINTF_FIND_READY:
+            return True
+        if self.container.exec_run(['sh', '-c', _PRINTF_FIND_SCRIPT]).exit_code != 0:
+            return False
+        _PRINTF_FIND_READY.add(self.container.id)
+        return True
+
+    def get_exported_files_with_size(self) -> List[Tuple[str, int]]:
+        """List files from a streamed export of the container, for images without a usable find"""
+        # Only tar headers are parsed; mounts such as /proc are not part of an export
+        entries = self._read_layer_entries(_ChunkReader(self.container.export())) or []
+        return self._without_ignored(entries)
+
+    def _without_ignored(self, entries: Iterable[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """Drop entries below ignore_paths, for listings that find did not prune"""
+        if not self.ignore_paths:
+            return list(entries)
+        prefixes = tuple(p + '/' for p in self.ignore_paths)
+        ignored = set(self.ignore_paths)
+        return [
+            (path, size) for path, size in entries
+            if path not in ignored and not path.startswith(prefixes)
+        ]
+
+    def get_layer_files_with_size(self, base_image: str) -> List[Tuple[str, int]]:
+        """List files added on top of base_image, read from the image's layer tarballs
+
+        Only tar headers are parsed, so nothing has to walk the container's
+        merged filesystem. Layers are matched to their diff IDs through the
+        saved manifest, since blob names and compression depend on the image store.
+        """
         try:
-            exec_command = self.container.exec_run('lsof -F n')
-            if exec_command.exit_code != 0:
-                return set()
-            
-            files = set()
-            for line in exec_command.output.decode('utf-8').split('\n'):
-                if line.startswith('n/'):
-                    files.add(line[1:])  # Remove 'n' prefix
-            return files
+            api = self.container.client.api
+            image_id = self.container.attrs['Image']
+            attrs = self.meta.attrs if self.meta else api.inspect_image(image_id)
+            diff_ids = attrs['RootFS']['Layers']
+            base_layers = set(api.inspect_image(base_image)['RootFS']['Layers'])
+            if all(layer in base_layers for layer in diff_ids):
+                return []
+
+            # The manifest naming each layer's member can come after the layers
+            # themselves, so every layer is read and the match is made afterwards
+            layer_entries = {}
+            documents = {}
+            with tarfile.open(fileobj=_ChunkReader(api.get_image(image_id)), mode='r|') as saved:
+                for member in saved:
+                    if not member.isfile():
+                        continue
+                    name = member.name
+                    if name.startswith('blobs/sha256/') and 'sha256:' + posixpath.basename(name) in base_layers:
+                        continue  # Uncompressed blob named by a base layer's diff ID
+                    fileobj = saved.extractfile(member)
+                    if member.size <= _MAX_DOCUMENT_SIZE:
+                        # Manifests and configs are small JSON; small layers are read from memory
+                        data = fileobj.read()
+                        if data[:1] in (b'{', b'['):
+                            try:
+                                documents[name] = json.loads(data)
+                                continue
+                            except ValueError:
+                                pass
+                        fileobj = io.BytesIO(data)
+                    entries = self._read_layer_entries(fileobj)
+                    if entries is not None:
+                        layer_entries[name] = entries
+
+            layer_names = self._saved_layer_names(documents, attrs)
+            if layer_names is None or len(layer_names) != len(diff_ids):
+                print("Error reading image layers: the saved image has no usable manifest")
+                return []
+
+            # Replay the layers bottom-up; a layer's whiteouts only hide lower layers
+            files = {}
+            for diff_id, name in zip(diff_ids, layer_names):
+                if diff_id in base_layers:
+                    continue
+                entries = layer_entries.get(name)
+                if entries is None:
+                    print(f"Error reading image layers: {name} is not a readable layer tar")
+                    return []
+                hidden = set()
+                hidden_prefixes = []
+                additions = []
+                for path, size in entries:
+                    directory, base = posixpath.split(path)
+                    if base == '.wh..wh..opq':
+                        hidden_prefixes.append(directory.rstrip('/') + '/')
+                    elif base.startswith('.wh.'):
+                        # The whiteout may hide a directory, which takes everything below it
+                        target = posixpath.join(directory, base[4:])
+                        hidden.add(target)
+                        hidden_prefixes.append(target + '/')
+                    else:
+                        additions.append((path, size))
+                if hidden_prefixes:
+                    # One filtering pass per layer, however many whiteouts it holds
+                    prefixes = tuple(hidden_prefixes)
+                    files = {
+                        p: s for p, s in files.items()
+                        if p not in hidden and not p.startswith(prefixes)
+                    }
+                files.update(additions)
+
+            log.debug("Found %d files in the layers above %s", len(files), base_image)
+            return self._without_ignored(files.items())
         except Exception as e:
-            print(f"Error getting lsof files: {e}")
-            return set()
+            print(f"Error reading image layers: {e}")
+            return []
+
+    def _saved_layer_names(self, documents: Dict[str, Any], attrs: Dict) -> Optional[List[str]]:
+        """Tar member of each layer, bottom-up, from a docker save's manifest.json or index.json"""
+        manifest = documents.get('manifest.json')
+        if manifest:
+            return manifest[0]['Layers']
+
+        # OCI only: follow the index down to the image manifest for this platform
+        node = documents.get('index.json')
+        while node and 'manifests' in node:
+            candidates = node['manifests']
+            matching = [
+                m for m in candidates
+                if m.get('platform', {}).get('architecture') in (None, attrs.get('Architecture'))
+            ]
+            digest = (matching or candidates)[0]['digest']
+            node = documents.get(_blob_name(digest))
+        if node and 'layers' in node:
+            return [_blob_name(layer['digest']) for layer in node['layers']]
+        return None
+
+    def _read_layer_entries(self, fileobj) -> Optional[List[Tuple[str, int]]]:
+        """Read (path, size) for regular files and whiteouts from one layer tar"""
+        try:
+            # 'r|*' also streams gzip, bzip2 and xz blobs, as a containerd store saves them
+            with tarfile.open(fileobj=fileobj, mode='r|*') as layer:
+                return [
+                    ('/' + posixpath.normpath(member.name).lstrip('/'), member.size)
+                    for member in layer
+                    if member.isfile()
+                ]
+        except tarfile.ReadError:
+            return None  # Config or manifest blob, not a layer
 
     def get_proc_files(self) -> Set[str]:
-        """Get list of files from /proc filesystem"""
+        """Get list of files opened or mapped by processes, from /proc/*/fd and /proc/*/maps"""
         try:
-            exec_command = self.container.exec_run('find /proc/*/fd -type l -ls')
-            if exec_command.exit_code != 0:
-                return set()
-            
             files = set()
-            for line in exec_command.output.decode('utf-8').split('\n'):
-                if ' -> ' in line:
-                    target = line.split(' -> ')[1].strip()
-                    if target.startswith('/'):
-                        files.add(target)
+            for line in self._stream_lines(['sh', '-c', _USED_FILES_SCRIPT]):
+                # Sockets, pipes and anonymous fds are not paths
+                if line.startswith(b'/'):
+                    files.add(line.decode('utf-8', 'replace'))
             return files
         except Exception as e:
             print(f"Error getting proc files: {e}")
@@ -78,29 +343,22 @@ class FilesystemAnalyzer:
 
     def is_system_path(self, path: str) -> bool:
         """Check if a path is a system path that should be excluded from analysis"""
-        system_paths = {
-            '/proc', '/sys', '/dev', '/tmp', '/run', '/var/run',
-            '/var/lock', '/var/cache', '/var/log'
-        }
         # Remove /var/lib/dpkg from system paths to include package files
-        return any(path.startswith(p) for p in system_paths)
+        # Below a system root exactly when the parent directory is, or is one itself
+        return path in _SYSTEM_PATHS or _is_system_dir(path.rpartition('/')[0])
 
     def get_all_used_files(self) -> Set[str]:
         """Get comprehensive list of used files"""
         used_files = set()
         
         try:
-            # Install necessary tools
-            self.container.exec_run('apt-get update && apt-get install -y lsof')
-            
-            # Static analysis
-            lsof_files = self.get_lsof_files()
-            proc_files = self.get_proc_files()
+            # Static analysis, reusing the scan from the file listing exec if it ran
+            proc_files = self._scanned_used
+            if proc_files is None:
+                proc_files = self.get_proc_files()
             
-            print(f"Debug: Found {len(lsof_files)} files from lsof")
-            print(f"Debug: Found {len(proc_files)} files from proc")
+            log.debug("Found %d files from proc", len(proc_files))
             
-            used_files.update(lsof_files)
             used_files.update(proc_files)
             
             # Add some common used files that might be missed
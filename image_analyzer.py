@@ -1,52 +1,66 @@
 from typing import Dict, List, Optional
+from functools import cached_property
 import docker
-from concurrent.futures import ThreadPoolExecutor
+from utils import format_size, load_cached, store_cached
 
-class ImageAnalyzer:
-    def __init__(self, client: docker.DockerClient):
+class ImageMetadata:
+    """Inspect data for one image, fetched once and shared by every analyzer"""
+    def __init__(self, client: docker.DockerClient, image_name: str):
         self.client = client
+        self.image_name = image_name
+        self.attrs = client.api.inspect_image(image_name)
+        self.id = self.attrs['Id']
+
+    @cached_property
+    def history(self) -> List[Dict]:
+        # Only layer analysis needs it, and a cached layer summary skips it entirely
+        return self.client.api.history(self.id)
+
+class ImageAnalyzer:
+    def __init__(self, meta: ImageMetadata, cache_results: bool = False):
+        self.meta = meta
+        self.cache_results = cache_results
 
-    def analyze_layers(self, image_name: str) -> Optional[Dict]:
+    def analyze_layers(self) -> Optional[Dict]:
         """Analyze Docker image layers and their sizes"""
+        # Layers are content-addressed, so a result keyed by image ID never goes stale
+        cache_key = f"layers_{self.meta.id}" if self.cache_results else None
+        if cache_key:
+            cached = load_cached(cache_key)
+            if cached is not None:
+                return cached
+
         try:
-            image = self.client.images.get(image_name)
-            with ThreadPoolExecutor() as executor:
-                layer_futures = [
-                    executor.submit(self._analyze_layer, layer)
-                    for layer in image.history()
-                ]
-                layers = [f.result() for f in layer_futures if f.result()['Size'] > 0]
+            attrs = self.meta.attrs
+            layers = [
+                self._analyze_layer(layer)
+                for layer in self.meta.history
+                if layer['Size'] > 0  # Skip empty layers
+            ]
             
             total_size = sum(layer['raw_size'] for layer in layers)
             
-            return {
+            result = {
                 'layers': layers,
-                'total_size': self._format_size(total_size),
+                'total_size': format_size(total_size),
                 'total_layers': len(layers),
-                'base_image': image.attrs['Config'].get('Image', 'unknown'),
-                'created': image.attrs['Created'],
-                'architecture': image.attrs['Architecture']
+                'base_image': attrs['Config'].get('Image', 'unknown'),
+                'created': attrs['Created'],
+                'architecture': attrs['Architecture']
             }
+            if cache_key:
+                store_cached(cache_key, result)
+            return result
         except docker.errors.ImageNotFound:
-            print(f"Image {image_name} not found")
+            print(f"Image {self.meta.image_name} not found")
             return None
         except Exception as e:
             print(f"Error analyzing image: {e}")
             return None
 
-    def _format_size(self, size_bytes: int) -> str:
-        """Convert bytes to human readable format"""
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size_bytes < 1024:
-                return f"{size_bytes:.2f}{unit}"
-            size_bytes /= 1024
-        return f"{size_bytes:.2f}TB"
-
     def _analyze_layer(self, layer):
-        if layer['Size'] > 0:  # Skip empty layers
-            return {
-                'created_by': layer.get('CreatedBy', 'unknown'),
-                'size': self._format_size(layer['Size']),
-                'raw_size': layer['Size']
-            }
-        return None
+        return {
+            'created_by': layer.get('CreatedBy', 'unknown'),
+            'size': format_size(layer['Size']),
+            'raw_size': layer['Size']
+        }
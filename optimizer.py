@@ -1,20 +1,31 @@
 #!/usr/bin/env python3
 import docker
-from typing import Dict, Optional, List, Tuple
+from typing import Dict, Optional, List, Set, Tuple
+import heapq
+import logging
+import os
 import sys
-import inquirer
-from inquirer import themes
 from container_manager import ContainerManager
-from image_analyzer import ImageAnalyzer
+from image_analyzer import ImageAnalyzer, ImageMetadata
 from progress_reporter import ProgressReporter
 from filesystem_analyzer import FilesystemAnalyzer
 from security_scanner import SecurityScanner
-from utils import display_analysis_results
+from utils import display_analysis_results, format_size
 from file_access_tracker import FileAccessTracker
+from config import CONFIG_PATH, AnalyzerConfig, load_config
 from dataclasses import dataclass
-import os
-from functools import lru_cache
-import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+# Package manager caches, as prefixes so every file below them is counted
+_PACKAGE_CACHE_DIRS = tuple(path + '/' for path in (
+    '/var/cache/apt',
+    '/var/lib/apt/lists',
+    '/var/cache/yum',
+    '/var/cache/dnf',
+    '/root/.cache/pip'
+))
 
 @dataclass
 class OptimizationSuggestion:
@@ -25,57 +36,80 @@ class OptimizationSuggestion:
 
 class DockerAnalyzer:
     """Main class for analyzing Docker images and containers"""
-    def __init__(self):
+    def __init__(self, config: Optional[AnalyzerConfig] = None):
+        self.config = config or AnalyzerConfig()
+        self._cache = {}
         try:
-            self.client = docker.from_client()
-        except:
-            try:
-                self.client = docker.from_env()
-            except docker.errors.DockerException as e:
-                print("❌ Error: Could not connect to Docker daemon")
-                print(f"Error details: {e}")
-                sys.exit(1)
+            self.client = docker.from_env()
+        except docker.errors.DockerException as e:
+            print("❌ Error: Could not connect to Docker daemon")
+            print(f"Error details: {e}")
+            sys.exit(1)
         self.container_manager = ContainerManager(self.client)
         
-    @lru_cache(maxsize=32)
-    def _get_image_hash(self, image_name: str) -> str:
-        image = self.client.images.get(image_name)
-        return image.id
+    def __enter__(self) -> 'DockerAnalyzer':
+        return self
+
+    def __exit__(self, *exc):
+        # Runs on errors and Ctrl-C too, so the helper container is never leaked
+        self.container_manager.cleanup()
+
+    def get_available_images(self) -> List[Tuple[str, int]]:
+        """List local images as (tag, size in bytes) over the SDK's open socket"""
+        return [
+            (image.tags[0] if image.tags else 'none:none', image.attrs['Size'])
+            for image in self.client.images.list()
+        ]
 
     def analyze_image(self, image_name: str) -> Dict:
-        image_hash = self._get_image_hash(image_name)
-        cache_key = f"analysis_{image_hash}"
+        # One inspect per analysis, shared by every analyzer below
+        meta = ImageMetadata(self.client, image_name)
+        cache_key = f"analysis_{meta.id}"
         
-        # Check if we have cached results
-        if hasattr(self, '_cache') and cache_key in self._cache:
+        # Check if we have cached results; only this session's, since the used
+        # files and processes are live container state, not part of the image
+        if cache_key in self._cache:
             return self._cache[cache_key]
         
+        track_access = self.config.access_window > 0
         progress = ProgressReporter()
-        progress.start_analysis(5)
+        progress.start_analysis(5 if track_access else 4)
 
-        # Step 1: Layer Analysis
-        progress.next_step("Analyzing image layers")
-        analyzer = ImageAnalyzer(self.client)
-        layer_info = analyzer.analyze_layers(image_name)
-        
-        # Step 2: Create container and analyze filesystem
-        container = self.container_manager.ensure_container_exists(image_name)
-        if not container:
-            return {}
+        # The three phases only wait on the Docker API, so threads overlap them
+        workers = 3 if self.config.parallel_analysis else 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Step 1: Layer Analysis, runs while the container is being created
+            analyzer = ImageAnalyzer(meta, cache_results=self.config.cache_results)
+            layer_future = self._submit_step(executor, progress, "Analyzed image layers", analyzer.analyze_layers)
             
-        progress.next_step("Analyzing filesystem")
-        fs_analyzer = FilesystemAnalyzer(container)
-        filesystem_info = self._analyze_filesystem(fs_analyzer)
-        
-        # Step 3: Security Analysis
-        progress.next_step("Performing security scan")
-        security_scanner = SecurityScanner(self.client, container)
-        security_info = security_scanner.scan_security(image_name)
-        
-        # Step 4: File Access Tracking
-        progress.next_step("Tracking file access patterns")
-        access_tracker = FileAccessTracker(container.id)
-        file_access = access_tracker.get_accessed_files()
+            # Step 2: Create container and analyze filesystem
+            container = self.container_manager.ensure_container_exists(image_name)
+            if not container:
+                return {}
+                
+            fs_analyzer = FilesystemAnalyzer(
+                container,
+                meta,
+                cache_results=self.config.cache_results,
+                ignore_paths=self.config.ignore_paths,
+                base_image=self.config.base_image
+            )
+            fs_future = self._submit_step(executor, progress, "Analyzed filesystem", self._analyze_filesystem, fs_analyzer)
+            
+            # Step 3: Security Analysis
+            security_scanner = SecurityScanner(self.client, container, meta)
+            security_future = self._submit_step(executor, progress, "Performed security scan", security_scanner.scan_security, image_name)
+
+        layer_info = layer_future.result()
+        filesystem_info = fs_future.result()
+        security_info = security_future.result()
+
+        # Step 4: File Access Tracking, opt-in, and only once the other phases'
+        # execs have exited, so the window sees the container rather than the analyzer
+        file_access = {}
+        if track_access:
+            file_access = self._track_file_access(FileAccessTracker(container))
+            progress.next_step("Tracked file access patterns")
         
         # Add optimization analysis
         progress.next_step("Analyzing optimization opportunities")
@@ -91,11 +125,22 @@ class DockerAnalyzer:
             'optimization_suggestions': optimization_suggestions
         }
         
-        # Cache the result
-        self._cache[cache_key] = result
+        # A failed phase may succeed next time, so only a complete analysis is kept
+        if layer_info and filesystem_info and security_info and 'error' not in security_info:
+            self._cache[cache_key] = result
         
         return result
 
+    def _submit_step(self, executor, progress: ProgressReporter, message: str, fn, *args) -> Future:
+        """Run one analysis phase on the executor, ticking progress when it finishes"""
+        future = executor.submit(fn, *args)
+        future.add_done_callback(lambda _: progress.next_step(message))
+        return future
+
+    def _track_file_access(self, access_tracker: FileAccessTracker) -> Dict[str, Set[str]]:
+        access_tracker.track_access(self.config.access_window)
+        return access_tracker.get_accessed_files()
+
     def _analyze_filesystem(self, fs_analyzer: FilesystemAnalyzer) -> Optional[Dict]:
         """Analyze filesystem and calculate usage"""
         try:
@@ -104,33 +149,41 @@ class DockerAnalyzer:
                 print("Warning: No files found in container")
                 return None
                 
-            all_files = {path for path, _ in all_files_with_size}
-            
             # Get used files using the comprehensive method
             used_files = fs_analyzer.get_all_used_files()
             
-            # Filter and calculate unused files
-            unused_files = {
-                (path, size) for path, size in all_files_with_size 
-                if path and not fs_analyzer.is_system_path(path) and path not in used_files
-            }
-            
-            total_size = sum(size for _, size in all_files_with_size)
-            unused_size = sum(size for _, size in unused_files)
+            # One pass totals every file and collects the unused ones with their sizes
+            total_size = 0
+            unused_size = 0
+            package_cache_size = 0
+            unused_sizes = {}
+            for path, size in all_files_with_size:
+                total_size += size
+                # Caches sit below system paths such as /var/cache, so count them first
+                if path.startswith(_PACKAGE_CACHE_DIRS):
+                    package_cache_size += size
+                if path and not fs_analyzer.is_system_path(path) and path not in used_files:
+                    unused_sizes[path] = size
+                    unused_size += size
+            # Only the count is displayed, so a full sort is paid for only when asked;
+            # without a limit the paths are a view of unused_sizes, not a second copy
+            limit = self.config.unused_files_limit
+            unused_files = heapq.nsmallest(limit, unused_sizes) if limit is not None else unused_sizes.keys()
             
             result = {
-                'all_files': len(all_files),
+                'all_files': len(all_files_with_size),  # find lists each path once
                 'total_size': total_size,
                 'used_files': len(used_files),
-                'unused_files': sorted(path for path, _ in unused_files),
-                'total_unused': len(unused_files),
-                'unused_size': unused_size
+                'unused_files': unused_files,
+                'unused_sizes': unused_sizes,
+                'total_unused': len(unused_sizes),
+                'unused_size': unused_size,
+                'package_cache_size': package_cache_size
             }
             
-            # Debug output
-            print(f"Debug: Found {len(all_files)} total files")
-            print(f"Debug: Found {len(used_files)} used files")
-            print(f"Debug: Found {len(unused_files)} unused files")
+            log.debug("Found %d total files", len(all_files_with_size))
+            log.debug("Found %d used files", len(used_files))
+            log.debug("Found %d unused files", len(unused_sizes))
             
             return result
         except Exception as e:
@@ -144,7 +197,7 @@ class DockerAnalyzer:
         # Check for large files that might be removable
         if filesystem_info and 'unused_files' in filesystem_info:
             large_unused_files = [
-                (path, size) for path, size in filesystem_info.get('unused_files', [])
+                (path, size) for path, size in filesystem_info.get('unused_sizes', {}).items()
                 if size > 10 * 1024 * 1024  # Files larger than 10MB
             ]
             if large_unused_files:
@@ -189,21 +242,8 @@ class DockerAnalyzer:
 
     def _analyze_package_cache(self, filesystem_info: Dict) -> int:
         """Analyze package manager cache size"""
-        cache_paths = [
-            '/var/cache/apt',
-            '/var/lib/apt/lists',
-            '/var/cache/yum',
-            '/var/cache/dnf',
-            '/root/.cache/pip'
-        ]
-        
-        total_cache_size = 0
-        for path in cache_paths:
-            if path in filesystem_info.get('unused_files', []):
-                # Get size from filesystem_info
-                total_cache_size += filesystem_info['unused_files'][path]
-                
-        return total_cache_size
+        # Summed from the full listing, since system paths never reach unused_sizes
+        return filesystem_info.get('package_cache_size', 0)
 
 def main():
     """Main function to run the Docker Image Analyzer"""
@@ -211,36 +251,36 @@ def main():
     print("------------------------")
     
     try:
-        analyzer = DockerAnalyzer()
-        images = analyzer.client.images.list()
-        
-        choices = [
-            (f"{image.tags[0] if image.tags else 'none:none'} ({image.attrs['Size']/(1024*1024*1024):.2f}GB)", 
-             image.tags[0] if image.tags else 'none:none') 
-            for image in images
-        ]
-        
-        questions = [
-            inquirer.List('image',
-                         message="Select a Docker image to analyze",
-                         choices=choices,
-                         carousel=True)
-        ]
+        # Settings are optional; without the file every default applies
+        config = load_config() if os.path.exists(CONFIG_PATH) else None
+        with DockerAnalyzer(config) as analyzer:
+            choices = [
+                (f"{image} ({format_size(size)})", image)
+                for image, size in analyzer.get_available_images()
+            ]
+            
+            # The prompt library is only needed for this one interactive question
+            import inquirer
+            from inquirer import themes
+
+            questions = [
+                inquirer.List('image',
+                             message="Select a Docker image to analyze",
+                             choices=choices,
+                             carousel=True)
+            ]
 
-        answers = inquirer.prompt(questions, theme=themes.GreenPassion())
-        if not answers:
-            return
+            answers = inquirer.prompt(questions, theme=themes.GreenPassion())
+            if not answers:
+                return
 
-        analysis = analyzer.analyze_image(answers['image'])
-        display_analysis_results(analysis)
+            analysis = analyzer.analyze_image(answers['image'])
+            display_analysis_results(analysis)
             
     except KeyboardInterrupt:
         print("\nAnalysis cancelled by user")
     except Exception as e:
         print(f"Unexpected error during analysis: {e}")
-    finally:
-        if 'analyzer' in locals():
-            analyzer.container_manager.cleanup()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,7 +1,7 @@
 from typing import Optional
 import sys
+import threading
 import time
-from tqdm import tqdm
 
 class ProgressReporter:
     def __init__(self):
@@ -9,18 +9,21 @@ class ProgressReporter:
         self.total_steps = 0
         self.start_time = None
         self.pbar = None
+        self._lock = threading.Lock()  # Phases report from worker threads
 
     def start_analysis(self, total_steps: int):
         self.total_steps = total_steps
         self.start_time = time.time()
+        from tqdm import tqdm  # Imported on first use, keeps module import cheap
         self.pbar = tqdm(total=total_steps, desc="🚀 Analyzing Docker Image")
         print("\n🚀 Starting Docker Image Analysis")
         print("================================")
 
     def next_step(self, message: str):
-        self.current_step += 1
-        self.pbar.set_description(f"🔍 {message}")
-        self.pbar.update(1)
+        with self._lock:
+            self.current_step += 1
+            self.pbar.set_description(f"🔍 {message}")
+            self.pbar.update(1)
 
     def report_progress(self, message: str):
         print(f"  → {message}")
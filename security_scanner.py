@@ -1,7 +1,13 @@
+import re
+
+# Env vars that look like credentials are kept out of the report
+_SECRET_RE = re.compile(r'password|key|token|secret', re.IGNORECASE)
+
 class SecurityScanner:
-    def __init__(self, client, container):
+    def __init__(self, client, container, meta=None):
         self.client = client
         self.container = container
+        self.meta = meta  # Shared ImageMetadata, saves re-inspecting the image
 
     def scan_security(self, image_name: str) -> dict:
         """Basic security scan of the image"""
@@ -13,8 +19,8 @@ class SecurityScanner:
         }
         
         try:
-            image = self.client.images.get(image_name)
-            config = image.attrs['Config']
+            attrs = self.meta.attrs if self.meta else self.client.images.get(image_name).attrs
+            config = attrs['Config']
             
             # Check exposed ports
             if config.get('ExposedPorts'):
@@ -29,19 +35,16 @@ class SecurityScanner:
             # Check environment variables
             if config.get('Env'):
                 results['environment_vars'] = [
-                    env for env in config['Env'] 
-                    if not any(secret in env.lower() 
-                              for secret in ['password', 'key', 'token', 'secret'])
+                    env for env in config['Env'] if not _SECRET_RE.search(env)
                 ]
                 
             # Check for root processes
             if self.container:
-                ps_cmd = self.container.exec_run('ps aux')
-                if ps_cmd.exit_code == 0:
-                    processes = ps_cmd.output.decode('utf-8').split('\n')
-                    results['root_processes'] = [
-                        p for p in processes if p.startswith('root')
-                    ]
+                # The daemon lists the processes itself, so no ps is needed in the image
+                top = self.container.top(ps_args='-eo user,pid,comm')
+                results['root_processes'] = [
+                    ' '.join(row) for row in top.get('Processes') or [] if row[0] == 'root'
+                ]
                     
             return results
         except Exception as e:
@@ -1,19 +1,71 @@
-from typing import Dict
+from typing import Any, Dict, Iterator, Optional, Tuple
 import json
-import jinja2
+import os
+
+CACHE_DIR = '.cache'
+
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
 
 def format_size(size_bytes: float) -> str:
     """Convert bytes to human readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size_bytes < 1024:
-            return f"{size_bytes:.2f} {unit}"
-        size_bytes /= 1024
-    return f"{size_bytes:.2f} PB"
+    # Every unit is a factor of 2**10, so the bit length picks it directly
+    unit = min(max(int(size_bytes).bit_length() - 1, 0) // 10, len(_SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (10 * unit)):.2f} {_SIZE_UNITS[unit]}"
 
 def format_number(num: int) -> str:
     """Format number with thousands separator"""
     return f"{num:,}"
 
+def _cache_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key.replace(':', '_')}.json")
+
+def load_cached(key: str) -> Optional[Any]:
+    """Load a cached analysis result, returns None on a cache miss"""
+    try:
+        with open(_cache_path(key), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def store_cached(key: str, data: Any):
+    """Persist an analysis result, a failed write only costs the next run"""
+    # Write aside and rename, so a concurrent or interrupted run never reads half a file
+    path = _cache_path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError) as e:
+        print(f"Warning: Could not cache {key}: {e}")
+        try:
+            os.remove(tmp_path)  # A dump that failed partway leaves a partial file
+        except OSError:
+            pass
+
+def stream_exec_lines(container, cmd, ok_exit_codes: Optional[Tuple[int, ...]] = None) -> Iterator[bytes]:
+    """Run a command in the container and yield raw stdout lines as they arrive
+
+    By default only 126/127 (the command never ran) raise RuntimeError; with
+    ok_exit_codes, any other exit code raises as well.
+    """
+    api = container.client.api
+    exec_id = api.exec_create(container.id, cmd)['Id']
+    leftover = b''
+    for stdout_chunk, _ in api.exec_start(exec_id, stream=True, demux=True):
+        if not stdout_chunk:
+            continue
+        lines = (leftover + stdout_chunk).split(b'\n')
+        leftover = lines.pop()  # Keep the partial last line for the next chunk
+        yield from lines
+    if leftover:
+        yield leftover
+    # Streaming hides the exit code; 126/127 means the command never ran at all
+    exit_code = api.exec_inspect(exec_id)['ExitCode']
+    if exit_code in (126, 127) or (ok_exit_codes is not None and exit_code not in ok_exit_codes):
+        raise RuntimeError(f"{cmd!r} failed in the container (exit code {exit_code})")
+
 def display_analysis_results(analysis: Dict):
     """Display formatted analysis results"""
     print("\n📊 Analysis Results")
@@ -47,4 +99,4 @@ def display_analysis_results(analysis: Dict):
                                key=lambda x: x.priority):
             print(f"\n🔹 {suggestion.category} (Priority: {suggestion.priority})")
             print(f"   {suggestion.description}")
-            print(f"   Potential savings: {_format_size(suggestion.potential_savings)}")
\ No newline at end of file
+            print(f"   Potential savings: {format_size(suggestion.potential_savings)}")
\ No newline at end of file